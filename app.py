@@ -6,36 +6,42 @@ from flask_login import (
     login_required,
     current_user,
 )
-from flask_wtf.csrf import CSRFError, generate_csrf
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask_wtf.csrf import CSRFError, generate_csrf, validate_csrf
+from wtforms.validators import ValidationError
+from security import hash_password, hash_password_async, verify_password
 from functools import wraps
+from collections import OrderedDict
+import fcntl
+import os
+import queue
+import threading
 import time
 import hashlib
 from config import Config
 from database import (
     init_database,
     User,
+    get_user_cached,
     get_total_stocks,
     get_all_stockholders,
+    get_total_allocated_stocks,
     update_user_stocks,
     update_total_stocks,
     create_user,
     delete_user,
     update_user_info,
     update_user_password,
-    record_login_attempt,
-    check_rate_limit,
+    record_login_attempts_bulk,
     cleanup_old_login_attempts,
     record_failed_login_attempt,
-    check_account_lockout,
+    login_prepare,
     clear_failed_login_attempts,
     revoke_user_sessions,
-    is_session_revoked,
+    get_revocation_watermark,
 )
 from forms import (
     LoginForm,
     UpdateStocksForm,
-    UpdateTotalStocksForm,
     CreateStockholderForm,
     ChangePasswordForm,
     ResetPasswordForm,
@@ -44,44 +50,129 @@ from forms import (
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Session timestamps are stored as small ints relative to this epoch so the
+# signed cookie serializes fewer bytes than an absolute float would
+_APP_EPOCH = 1_700_000_000
+
+# Dummy hash verified when the submitted email matches no account, so login
+# always costs exactly one hash check. Skipping the check for unknown emails
+# would leak account existence through response timing and make per-request
+# CPU cost swing between ~0 and hundreds of milliseconds.
+_DUMMY_HASH = hash_password("x" * 16)
+
+
+# Key for log-correlation hashes; keyed hashing makes the tokens
+# unlinkable across deployments with different secrets
+_LOG_HASH_KEY = Config.SECRET_KEY.encode()[:64]
+
 
 def hash_for_logging(sensitive_value):
     """
     Hash sensitive values for safe logging.
-    Uses SHA256 and returns first 8 chars of hash for correlation without revealing actual values.
+    Uses keyed BLAKE2b and returns 8 hex chars for correlation without revealing actual values.
     """
     if not sensitive_value:
         return "NONE"
-    hash_object = hashlib.sha256(str(sensitive_value).encode())
-    return hash_object.hexdigest()[:8]
+    return hashlib.blake2b(
+        str(sensitive_value).encode(), digest_size=4, key=_LOG_HASH_KEY
+    ).hexdigest()
+
+
+def _norm_email(email):
+    """Normalize a submitted email address for lookups and storage."""
+    return email.strip().casefold() if email else ""
+
+
+# In-process token buckets for rate limiting, keyed by client IP. Bounded
+# LRU so a scan across many source addresses cannot grow memory unbounded.
+_RATE_LIMIT_MAX_BUCKETS = 10_000
+_rate_limit_buckets = OrderedDict()
+_rate_limit_lock = threading.Lock()
+
+# Attempts are still persisted for audit, but batched through a queue and a
+# single background writer so the request path never waits on SQLite.
+_audit_queue = queue.Queue()
+
+
+# How long the writer waits to coalesce attempts into one transaction, and
+# a cap so a flood cannot defer the flush indefinitely.
+_AUDIT_FLUSH_WINDOW_SECONDS = 0.25
+_AUDIT_MAX_BATCH = 1000
+
+
+def _audit_writer():
+    """Drain queued login attempts and persist them in batches.
+
+    After the first entry arrives, keeps collecting for a short window so a
+    burst of logins becomes one INSERT transaction (one fsync) instead of
+    one per attempt.
+    """
+    while True:
+        entries = [_audit_queue.get()]
+        deadline = time.monotonic() + _AUDIT_FLUSH_WINDOW_SECONDS
+        while len(entries) < _AUDIT_MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entries.append(_audit_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            record_login_attempts_bulk(entries)
+        except Exception as e:
+            app.logger.error(f"Error persisting login attempt audit batch: {e}")
+
+
+_audit_thread = threading.Thread(
+    target=_audit_writer, name="login-audit-writer", daemon=True
+)
+_audit_thread.start()
 
 
 def rate_limit(max_attempts=99, window_minutes=5):
-    """Rate limiting decorator for login attempts using database."""
+    """Rate limiting decorator using an in-memory token bucket per client IP."""
+    refill_rate = max_attempts / (window_minutes * 60)
 
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
+            # Idempotent GETs (e.g. rendering the login page) don't count
+            # toward the limit; only state-changing submissions do.
+            if request.method != "POST":
+                return f(*args, **kwargs)
+
             # Use direct connection IP to prevent spoofing attacks
             client_ip = request.remote_addr
+            now = time.monotonic()
 
-            # Check if rate limit exceeded
-            is_limited, attempt_count = check_rate_limit(
-                client_ip, max_attempts, window_minutes
-            )
-
-            if is_limited:
-                flash(
-                    f"Too many login attempts. Please try again in {window_minutes} minutes.",
-                    "error",
+            with _rate_limit_lock:
+                last_refill, tokens = _rate_limit_buckets.get(
+                    client_ip, (now, float(max_attempts))
                 )
-                app.logger.warning(
-                    f"Rate limit exceeded for IP {client_ip} ({attempt_count} attempts)"
+                tokens = min(
+                    float(max_attempts), tokens + (now - last_refill) * refill_rate
+                )
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                _rate_limit_buckets[client_ip] = (now, tokens)
+                _rate_limit_buckets.move_to_end(client_ip)
+                while len(_rate_limit_buckets) > _RATE_LIMIT_MAX_BUCKETS:
+                    _rate_limit_buckets.popitem(last=False)
+
+            # Record this attempt asynchronously for audit
+            _audit_queue.put((client_ip, time.time()))
+
+            if not allowed:
+                # Deliberately cheap response: no form construction and no
+                # template render on the path an attacker can hammer.
+                app.logger.warning(f"Rate limit exceeded for IP {client_ip}")
+                return (
+                    f"Too many login attempts. Please try again in {window_minutes} minutes.",
+                    429,
+                    {"Retry-After": str(window_minutes * 60)},
                 )
-                return render_template("login.html", form=LoginForm())
-
-            # Record this attempt
-            record_login_attempt(client_ip)
 
             return f(*args, **kwargs)
 
@@ -94,26 +185,43 @@ def rate_limit(max_attempts=99, window_minutes=5):
 def check_session_validity():
     """Check if current user's session has been revoked."""
     if current_user.is_authenticated:
-        session_created = session.get("created_at", 0)
+        raw_created = session.get("created_at", 0)
+        # Sessions issued before the epoch-relative scheme stored an
+        # absolute timestamp; values that large need no adjustment
+        session_created = (
+            raw_created + _APP_EPOCH if raw_created < _APP_EPOCH else raw_created
+        )
 
-        if is_session_revoked(current_user.id, session_created):
+        # The in-memory watermark cache is authoritative: it is updated on
+        # every revocation in this worker and re-read from the database on
+        # a short TTL for revocations made elsewhere.
+        watermark = get_revocation_watermark(current_user.id)
+        if watermark is not None and session_created < watermark:
             logout_user()
             flash("Your session has been invalidated. Please log in again.", "info")
             return redirect(url_for("login"))
 
 
+# Built once at import so the long CSP literal isn't reassembled on every
+# response.
+_SECURITY_HEADERS = (
+    ("X-Content-Type-Options", "nosniff"),
+    ("X-Frame-Options", "DENY"),
+    ("X-XSS-Protection", "1; mode=block"),
+    ("Strict-Transport-Security", "max-age=31536000; includeSubDomains"),
+    (
+        "Content-Security-Policy",
+        "default-src 'self'; script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://fonts.googleapis.com; font-src 'self' https://fonts.gstatic.com https://cdn.jsdelivr.net; img-src 'self' data:;",
+    ),
+)
+
+
 @app.after_request
 def add_security_headers(response):
     """Add security headers to all responses."""
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = (
-        "max-age=31536000; includeSubDomains"
-    )
-    response.headers["Content-Security-Policy"] = (
-        "default-src 'self'; script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://fonts.googleapis.com; font-src 'self' https://fonts.gstatic.com https://cdn.jsdelivr.net; img-src 'self' data:;"
-    )
+    headers = response.headers
+    for key, value in _SECURITY_HEADERS:
+        headers[key] = value
     return response
 
 
@@ -127,7 +235,7 @@ login_manager.login_message_category = "info"
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.get(int(user_id))
+    return get_user_cached(int(user_id))
 
 
 # Initialize database on first run
@@ -150,12 +258,24 @@ def login():
     if current_user.is_authenticated:
         return redirect(url_for("index"))
 
+    if request.method == "POST":
+        # Cheap rejection of obviously malformed submissions before any
+        # WTForms validation runs — brute-force floods rarely bother with
+        # well-formed credentials. No '@' requirement: the bootstrap admin
+        # account's email is a bare username.
+        email_raw = request.form.get("email", "")
+        password_raw = request.form.get("password", "")
+        if not email_raw.strip() or not password_raw or len(email_raw) > 254:
+            flash("Invalid email or password.", "error")
+            return render_template("login.html", form=LoginForm())
+
     form = LoginForm()
     if form.validate_on_submit():
-        email = form.email.data.strip().lower()
+        email = _norm_email(form.email.data)
+
+        # One round trip fetches the user row and lockout state together
+        user, is_locked, attempts_left, lockout_time = login_prepare(email)
 
-        # Check if account is locked due to failed attempts
-        is_locked, attempts_left, lockout_time = check_account_lockout(email)
         if is_locked:
             flash(
                 f"Account locked due to too many failed attempts. Try again in {lockout_time} minutes.",
@@ -166,15 +286,20 @@ def login():
             )
             return render_template("login.html", form=form)
 
-        user = User.get_by_email(email)
+        # Always run exactly one hash verification, against a dummy hash if
+        # the account doesn't exist, to keep timing independent of whether
+        # the email is registered.
+        password_hash = user.password_hash if user else _DUMMY_HASH
+        password_ok = verify_password(password_hash, form.password.data)
 
-        if user and check_password_hash(user.password_hash, form.password.data):
+        if user and password_ok:
             # Successful login - clear failed attempts
             clear_failed_login_attempts(email)
             login_user(user, remember=True)
 
-            # Store session creation time for session revocation checks
-            session["created_at"] = time.time()
+            # Store session creation time (epoch-relative int, which keeps
+            # the signed cookie short) for session revocation checks
+            session["created_at"] = int(time.time()) - _APP_EPOCH
 
             next_page = request.args.get("next")
             if not next_page or not next_page.startswith("/"):
@@ -184,10 +309,10 @@ def login():
             # Failed login - record attempt
             record_failed_login_attempt(email, request.remote_addr)
 
-            # Check how many attempts remaining
-            is_locked, attempts_left, lockout_time = check_account_lockout(email)
+            # Derive the post-failure count locally instead of re-querying
+            attempts_left = max(0, attempts_left - 1)
 
-            if is_locked:
+            if attempts_left == 0:
                 flash(
                     f"Too many failed attempts. Account locked for {lockout_time} minutes.",
                     "error",
@@ -236,46 +361,21 @@ def admin_dashboard():
         flash("Access denied. Admin privileges required.", "error")
         return redirect(url_for("dashboard"))
 
-    stockholders = get_all_stockholders()
     total_stocks = get_total_stocks()
 
-    # Calculate percentages and total allocated stocks
-    total_allocated = 0
-    stockholders_data = []
-
-    for stockholder in stockholders:
-        stock_count = stockholder["stock_count"] or 0
-        percentage = (stock_count / total_stocks * 100) if total_stocks > 0 else 0
-        total_allocated += stock_count
-
-        stockholders_data.append(
-            {
-                "id": stockholder["id"],
-                "name": stockholder["name"],
-                "email": stockholder["email"],
-                "stock_count": stock_count,
-                "percentage": percentage,
-            }
-        )
-
-    # Sort stockholders by ownership percentage (descending), then by last name (ascending)
-    stockholders_data.sort(
-        key=lambda x: (-x["percentage"], x["name"].split()[-1].lower())
-    )
+    # Percentages, sort order, and the allocated total are all computed by
+    # SQLite, so the handler just forwards rows to the template.
+    stockholders_data = get_all_stockholders(total_stocks)
+    total_allocated = get_total_allocated_stocks()
 
     unallocated_stocks = total_stocks - total_allocated
 
-    # Create forms
-    total_stocks_form = UpdateTotalStocksForm()
-    total_stocks_form.total_stocks.data = total_stocks
-
     return render_template(
         "admin.html",
         stockholders=stockholders_data,
         total_stocks=total_stocks,
         total_allocated=total_allocated,
         unallocated_stocks=unallocated_stocks,
-        total_stocks_form=total_stocks_form,
         csrf_token=generate_csrf,
     )
 
@@ -293,7 +393,7 @@ def update_stocks():
         try:
             user_id = form.user_id.data
             name = form.name.data.strip()
-            email = form.email.data.strip().lower()
+            email = _norm_email(form.email.data)
             stock_count = form.stock_count.data
 
             # Prevent updating admin users through this endpoint
@@ -331,15 +431,22 @@ def update_total_stocks_route():
         flash("Access denied. Admin privileges required.", "error")
         return redirect(url_for("dashboard"))
 
-    form = UpdateTotalStocksForm()
-    if form.validate_on_submit():
-        try:
-            update_total_stocks(form.total_stocks.data)
-            flash("Total stocks updated successfully.", "success")
-        except Exception as e:
-            flash(f"Error updating total stocks: {str(e)}", "error")
-    else:
+    # The total-stocks form is rendered as a plain template form, so the
+    # CSRF token and value are validated by hand here
+    try:
+        validate_csrf(request.form.get("csrf_token"))
+        total_stocks = int(request.form.get("total_stocks", ""))
+        if total_stocks < 1:
+            raise ValueError("Total stocks must be positive")
+    except (ValidationError, ValueError):
         flash("Invalid form data.", "error")
+        return redirect(url_for("admin_dashboard"))
+
+    try:
+        update_total_stocks(total_stocks)
+        flash("Total stocks updated successfully.", "success")
+    except Exception as e:
+        flash(f"Error updating total stocks: {str(e)}", "error")
 
     return redirect(url_for("admin_dashboard"))
 
@@ -353,19 +460,23 @@ def create_stockholder():
 
     form = CreateStockholderForm()
     if form.validate_on_submit():
+        email = _norm_email(form.email.data)
+
+        # Start hashing on the pool so it overlaps the duplicate-email check
+        password_hash_future = hash_password_async(form.password.data)
+
         # Check if user already exists
-        existing_user_by_email = User.get_by_email(form.email.data.strip().lower())
+        existing_user_by_email = User.get_by_email(email)
 
         if existing_user_by_email:
             flash("Email already exists. Please choose a different one.", "error")
             return render_template("create_stockholder.html", form=form)
 
         # Create new stockholder
-        password_hash = generate_password_hash(form.password.data)
         user_id = create_user(
             form.name.data,
-            form.email.data.strip().lower(),
-            password_hash,
+            email,
+            password_hash_future.result(),
             form.stock_count.data,
         )
 
@@ -413,12 +524,15 @@ def delete_stockholder(user_id):
 def change_password():
     form = ChangePasswordForm()
     if form.validate_on_submit():
-        # Verify current password
-        user = User.get_by_email(current_user.email)
-        if user and check_password_hash(user.password_hash, form.current_password.data):
+        # Hash the new password on the pool while the current one verifies;
+        # the two costs overlap instead of running back to back
+        new_hash_future = hash_password_async(form.new_password.data)
+
+        # Verify current password; current_user already carries the hash,
+        # so no need to re-fetch the same row by email
+        if verify_password(current_user.password_hash, form.current_password.data):
             # Update password
-            new_password_hash = generate_password_hash(form.new_password.data)
-            if update_user_password(current_user.id, new_password_hash):
+            if update_user_password(current_user.id, new_hash_future.result()):
                 # Logout user to force re-authentication with new password
                 logout_user()
                 flash(
@@ -458,7 +572,7 @@ def reset_user_password(user_id):
     if form.validate_on_submit():
         try:
             # Hash and update password
-            new_password_hash = generate_password_hash(form.new_password.data)
+            new_password_hash = hash_password(form.new_password.data)
             if update_user_password(user_id, new_password_hash):
                 # Revoke all sessions for this user
                 revoke_user_sessions(user_id, reason="admin_password_reset")
@@ -485,20 +599,40 @@ def reset_user_password(user_id):
     return redirect(url_for("admin_dashboard"))
 
 
+# Error pages are pre-rendered once for the anonymous view, so a flood of
+# bad URLs doesn't pay a Jinja render per hit. Authenticated users still
+# get a live render because the navbar reflects their session.
+_ERROR_TEMPLATES = {403: "403.html", 404: "404.html", 500: "500.html"}
+_error_page_cache = {}
+
+
+def _prerender_error_pages():
+    with app.test_request_context():
+        for code, template in _ERROR_TEMPLATES.items():
+            _error_page_cache[code] = render_template(template).encode()
+
+
+def _error_response(code):
+    body = _error_page_cache.get(code)
+    if current_user.is_authenticated or body is None:
+        return render_template(_ERROR_TEMPLATES[code]), code
+    return app.response_class(body, status=code, mimetype="text/html")
+
+
 @app.errorhandler(404)
 def not_found(error):
-    return render_template("404.html"), 404
+    return _error_response(404)
 
 
 @app.errorhandler(403)
 def forbidden(error):
-    return render_template("403.html"), 403
+    return _error_response(403)
 
 
 @app.errorhandler(500)
 def internal_error(error):
     app.logger.error(f"Server Error: {error}")
-    return render_template("500.html"), 500
+    return _error_response(500)
 
 
 @app.errorhandler(CSRFError)
@@ -508,10 +642,22 @@ def csrf_error(error):
 
 
 def startup_cleanup():
-    """Cleanup old login attempts when app starts."""
+    """Cleanup old login attempts in the background after app start.
+
+    A non-blocking file lock ensures only one gunicorn worker performs
+    the delete; the others skip it.
+    """
+    lock_path = os.path.join(os.path.dirname(Config.DATABASE_PATH), "cleanup.lock")
     try:
-        cleanup_old_login_attempts(hours=24)
-        app.logger.info("Cleaned up old login attempts")
+        with open(lock_path, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is already handling cleanup
+                return
+
+            cleanup_old_login_attempts(hours=24)
+            app.logger.info("Cleaned up old login attempts")
     except Exception as e:
         app.logger.error(f"Error during startup cleanup: {e}")
 
@@ -525,7 +671,6 @@ def inject_company_info():
     company = conn.execute(
         "SELECT company_name, total_stocks FROM company_info LIMIT 1"
     ).fetchone()
-    conn.close()
     return {
         "company_name": company["company_name"] if company else "Your Company",
         "company_total_stocks": company["total_stocks"] if company else 0,
@@ -541,12 +686,24 @@ def export_database():
         return redirect(url_for("dashboard"))
 
     from flask import send_file
-    import os
+    import sqlite3
+
+    from database import get_db_connection
 
     db_path = Config.DATABASE_PATH
     if os.path.exists(db_path):
+        # With WAL, committed rows live in database.db-wal until a
+        # checkpoint, so sending the main file alone would drop them.
+        # backup() snapshots the full committed state into one file.
+        export_path = db_path + ".export"
+        dest = sqlite3.connect(export_path)
+        try:
+            with dest:
+                get_db_connection().backup(dest)
+        finally:
+            dest.close()
         return send_file(
-            db_path,
+            export_path,
             as_attachment=True,
             download_name=f"database_export.db",
         )
@@ -555,9 +712,12 @@ def export_database():
         return redirect(url_for("admin_dashboard"))
 
 
-# Perform cleanup on startup
-with app.app_context():
-    startup_cleanup()
+# Pre-render error pages once at startup
+_prerender_error_pages()
+
+# Perform cleanup on startup in the background so worker readiness isn't
+# delayed by a DELETE that scales with the login_attempts table size
+threading.Thread(target=startup_cleanup, name="startup-cleanup", daemon=True).start()
 
 if __name__ == "__main__":
     app.run(debug=app.config["DEBUG"], host="127.0.0.1", port=5002)
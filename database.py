@@ -1,8 +1,20 @@
 import sqlite3
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from werkzeug.security import generate_password_hash
 from config import Config
+from security import hash_password
+
+# In-memory cache of the latest revocation time per user so the per-request
+# session check can skip the database entirely. Re-hydrated from the
+# session_revocations table every few seconds so revocations made by other
+# gunicorn workers take effect promptly.
+_REVOCATION_TTL_SECONDS = 5.0
+_revocation_watermark = {}
+_revocation_watermark_lock = threading.Lock()
+_revocation_watermark_loaded_at = None
 
 
 def init_database():
@@ -12,8 +24,11 @@ def init_database():
     # Ensure the instance directory exists
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
-    conn = sqlite3.connect(db_path)
+    # Autocommit connection + explicit BEGIN so the whole schema setup is
+    # one transaction (one fsync) instead of ~10 auto-committed statements
+    conn = sqlite3.connect(db_path, isolation_level=None)
     cursor = conn.cursor()
+    cursor.execute("BEGIN")
 
     # Users table
     cursor.execute(
@@ -22,7 +37,7 @@ def init_database():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
             name TEXT,
-            email TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL COLLATE NOCASE,
             password_hash TEXT NOT NULL,
             is_admin BOOLEAN DEFAULT FALSE,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -73,7 +88,7 @@ def init_database():
         """
         CREATE TABLE IF NOT EXISTS failed_login_attempts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT NOT NULL,
+            email TEXT NOT NULL COLLATE NOCASE,
             ip_address TEXT NOT NULL,
             attempt_time REAL NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -104,9 +119,24 @@ def init_database():
     """
     )
 
-    # Check if admin user exists, if not create one
-    cursor.execute("SELECT id FROM users WHERE is_admin = 1")
-    admin_exists = cursor.fetchone()
+    # Unique index: one stocks row per user, supports the dashboard join
+    # and the ON CONFLICT(user_id) upserts
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_stocks_user_unique ON stocks(user_id)"
+    )
+
+    # Index so cleanup's WHERE attempt_time < ? is a range scan
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_login_attempts_time ON login_attempts(attempt_time)"
+    )
+
+    # Check for the admin user and company info in one round trip
+    admin_exists, company_exists = cursor.execute(
+        """
+        SELECT (SELECT 1 FROM users WHERE is_admin = 1 LIMIT 1),
+               (SELECT 1 FROM company_info LIMIT 1)
+    """
+    ).fetchone()
 
     if not admin_exists:
         # Create default admin user with password from environment variable
@@ -114,14 +144,8 @@ def init_database():
         if not admin_password:
             # Generate a secure random password if not provided
             import secrets
-            import string
 
-            admin_password = "".join(
-                secrets.choice(
-                    string.ascii_letters + string.digits + string.punctuation
-                )
-                for _ in range(16)
-            )
+            admin_password = secrets.token_urlsafe(16)
             print("\n" + "=" * 60)
             print("IMPORTANT: Default admin account created!")
             print(f"Email: admin")
@@ -129,7 +153,7 @@ def init_database():
             print("Please change this password immediately after first login!")
             print("=" * 60 + "\n")
 
-        admin_password_hash = generate_password_hash(admin_password)
+        admin_password_hash = hash_password(admin_password)
         cursor.execute(
             """
             INSERT INTO users (username, name, email, password_hash, is_admin)
@@ -149,10 +173,6 @@ def init_database():
             (admin_id, 0, "Administrator account"),
         )
 
-    # Check if company info exists, if not create default
-    cursor.execute("SELECT id FROM company_info")
-    company_exists = cursor.fetchone()
-
     if not company_exists:
         cursor.execute(
             """
@@ -162,14 +182,50 @@ def init_database():
             (10000000, Config.COMPANY_NAME),
         )
 
-    conn.commit()
+    cursor.execute("COMMIT")
     conn.close()
 
 
+# One long-lived connection per thread. Opening a fresh SQLite connection
+# for every helper call costs an fd open plus journal/pragma handshakes,
+# which dominates the cheap queries on the request path.
+_connection_tls = threading.local()
+
+
+def _last_name_key(name):
+    """Sort key for the stockholder list: lowercase last token of the name."""
+    if not name:
+        return ""
+    parts = name.split()
+    return parts[-1].lower() if parts else ""
+
+
 def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    """Get this thread's database connection, creating it on first use.
+
+    The connection is long-lived and must not be closed by callers. WAL
+    mode lets readers proceed concurrently with the occasional write, and
+    autocommit (isolation_level=None) keeps independent helpers from
+    accidentally sharing an implicit transaction; explicit BEGIN/COMMIT
+    still works for multi-statement updates.
+    """
+    conn = getattr(_connection_tls, "conn", None)
+    if conn is None:
+        # cached_statements keeps prepared plans for the app's SQL strings
+        # alive for the life of the connection, so hot queries skip
+        # re-parsing; worthwhile now that connections are long-lived
+        conn = sqlite3.connect(
+            Config.DATABASE_PATH, isolation_level=None, cached_statements=256
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.create_function("last_name_key", 1, _last_name_key, deterministic=True)
+        conn.row_factory = sqlite3.Row
+        _connection_tls.conn = conn
     return conn
 
 
@@ -190,17 +246,19 @@ class User:
     def get(user_id):
         conn = get_db_connection()
         user_data = conn.execute(
-            "SELECT id, name, email, is_admin FROM users WHERE id = ?", (user_id,)
+            "SELECT id, name, email, password_hash, is_admin FROM users WHERE id = ?",
+            (user_id,),
         ).fetchone()
-        conn.close()
 
         if user_data:
-            return User(
+            user = User(
                 user_data["id"],
                 user_data["name"],
                 user_data["email"],
                 user_data["is_admin"],
             )
+            user.password_hash = user_data["password_hash"]
+            return user
         return None
 
     @staticmethod
@@ -210,7 +268,6 @@ class User:
             "SELECT id, name, email, password_hash, is_admin FROM users WHERE email = ?",
             (email,),
         ).fetchone()
-        conn.close()
 
         if user_data:
             user = User(
@@ -230,7 +287,6 @@ class User:
             "SELECT stock_count, last_updated, notes FROM stocks WHERE user_id = ?",
             (self.id,),
         ).fetchone()
-        conn.close()
 
         if stocks_data:
             return {
@@ -242,69 +298,142 @@ class User:
 
     def get_ownership_percentage(self):
         """Calculate user's ownership percentage."""
-        stocks = self.get_stocks()
-        total_stocks = get_total_stocks()
+        conn = get_db_connection()
+        row = conn.execute(
+            """
+            SELECT COALESCE(s.stock_count, 0) * 100.0 / NULLIF(c.total_stocks, 0)
+            FROM company_info c
+            LEFT JOIN stocks s ON s.user_id = ?
+            LIMIT 1
+        """,
+            (self.id,),
+        ).fetchone()
+
+        return (row[0] or 0) if row else 0
+
+
+# Bounded TTL cache of User objects so Flask-Login's per-request user load
+# doesn't hit the database every page view. Mutating helpers evict entries;
+# the TTL bounds staleness across gunicorn workers.
+_USER_CACHE_TTL_SECONDS = 30.0
+_USER_CACHE_MAX_ENTRIES = 1024
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cached(user_id):
+    """Fetch a User by id through the TTL cache (used by load_user)."""
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry is not None:
+            expires_at, user = entry
+            if now < expires_at:
+                return user
+            del _user_cache[user_id]
+
+    user = User.get(user_id)
+    if user is not None:
+        with _user_cache_lock:
+            _user_cache[user_id] = (now + _USER_CACHE_TTL_SECONDS, user)
+            _user_cache.move_to_end(user_id)
+            while len(_user_cache) > _USER_CACHE_MAX_ENTRIES:
+                _user_cache.popitem(last=False)
+    return user
 
-        if total_stocks > 0:
-            return (stocks["count"] / total_stocks) * 100
-        return 0
+
+def _evict_cached_user(user_id):
+    """Drop a user from the cache after their row changes."""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+# In-process cache for the company's total stock count. The value only
+# changes via update_total_stocks, which writes through; a short TTL bounds
+# staleness across gunicorn workers that didn't see the write.
+_TOTAL_STOCKS_TTL_SECONDS = 5.0
+_total_stocks_cache = {"value": None, "cached_at": 0.0}
+_total_stocks_lock = threading.Lock()
 
 
 def get_total_stocks():
-    """Get total company stocks."""
+    """Get total company stocks (cached in-process)."""
+    now = time.monotonic()
+    with _total_stocks_lock:
+        if (
+            _total_stocks_cache["value"] is not None
+            and now - _total_stocks_cache["cached_at"] < _TOTAL_STOCKS_TTL_SECONDS
+        ):
+            return _total_stocks_cache["value"]
+
     conn = get_db_connection()
     result = conn.execute("SELECT total_stocks FROM company_info LIMIT 1").fetchone()
-    conn.close()
 
-    return result["total_stocks"] if result else 0
+    total_stocks = result["total_stocks"] if result else 0
+    with _total_stocks_lock:
+        _total_stocks_cache["value"] = total_stocks
+        _total_stocks_cache["cached_at"] = now
+
+    return total_stocks
 
 
-def get_all_stockholders():
-    """Get all stockholders with their stock information (admin only)."""
+def get_all_stockholders(total_stocks=None):
+    """Get all stockholders with their stock information (admin only).
+
+    When total_stocks is given, each row also carries an ownership
+    percentage and rows come back sorted by percentage (descending), then
+    by last name (the portion of the name after the first space) — all
+    computed by SQLite so the caller doesn't re-sort in Python.
+    """
+    pct_scale = (100.0 / total_stocks) if total_stocks else 0.0
+
     conn = get_db_connection()
     result = conn.execute(
         """
-        SELECT u.id, u.name, u.email, s.stock_count
+        SELECT u.id, u.name, u.email,
+               COALESCE(s.stock_count, 0) AS stock_count,
+               COALESCE(s.stock_count, 0) * ? AS percentage
         FROM users u
         LEFT JOIN stocks s ON u.id = s.user_id
         WHERE u.is_admin = 0
-        ORDER BY u.name
-    """
+        ORDER BY percentage DESC, last_name_key(u.name) ASC
+    """,
+        (pct_scale,),
     ).fetchall()
-    conn.close()
 
     return result
 
 
-def update_user_stocks(user_id, stock_count, notes=None):
-    """Update a user's stock count."""
+def get_total_allocated_stocks():
+    """Get the sum of stocks allocated to non-admin stockholders."""
     conn = get_db_connection()
-
-    # Check if stocks record exists
-    existing = conn.execute(
-        "SELECT id FROM stocks WHERE user_id = ?", (user_id,)
+    result = conn.execute(
+        """
+        SELECT COALESCE(SUM(s.stock_count), 0)
+        FROM stocks s
+        JOIN users u ON u.id = s.user_id
+        WHERE u.is_admin = 0
+    """
     ).fetchone()
 
-    if existing:
-        conn.execute(
-            """
-            UPDATE stocks
-            SET stock_count = ?, notes = ?, last_updated = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-        """,
-            (stock_count, notes, user_id),
-        )
-    else:
-        conn.execute(
-            """
-            INSERT INTO stocks (user_id, stock_count, notes)
-            VALUES (?, ?, ?)
-        """,
-            (user_id, stock_count, notes),
-        )
+    return result[0]
 
+
+def update_user_stocks(user_id, stock_count, notes=None):
+    """Update a user's stock count."""
+    conn = get_db_connection()
+    conn.execute(
+        """
+        INSERT INTO stocks (user_id, stock_count, notes)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            stock_count = excluded.stock_count,
+            notes = excluded.notes,
+            last_updated = CURRENT_TIMESTAMP
+    """,
+        (user_id, stock_count, notes),
+    )
     conn.commit()
-    conn.close()
 
 
 def update_user_info(user_id, name, email, stock_count):
@@ -324,31 +453,21 @@ def update_user_info(user_id, name, email, stock_count):
             (name, email, user_id),
         )
 
-        # Update stocks information
-        existing = conn.execute(
-            "SELECT id FROM stocks WHERE user_id = ?", (user_id,)
-        ).fetchone()
-
-        if existing:
-            conn.execute(
-                """
-                UPDATE stocks
-                SET stock_count = ?, last_updated = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            """,
-                (stock_count, user_id),
-            )
-        else:
-            conn.execute(
-                """
-                INSERT INTO stocks (user_id, stock_count)
-                VALUES (?, ?)
-            """,
-                (user_id, stock_count),
-            )
+        # Update stocks information (single upsert instead of SELECT+branch)
+        conn.execute(
+            """
+            INSERT INTO stocks (user_id, stock_count)
+            VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                stock_count = excluded.stock_count,
+                last_updated = CURRENT_TIMESTAMP
+        """,
+            (user_id, stock_count),
+        )
 
         # Commit transaction - both updates succeed together
         conn.commit()
+        _evict_cached_user(user_id)
         return True
     except sqlite3.IntegrityError:
         # Username or email already exists - rollback all changes
@@ -358,8 +477,6 @@ def update_user_info(user_id, name, email, stock_count):
         # Any other error - rollback all changes
         conn.rollback()
         return False
-    finally:
-        conn.close()
 
 
 def update_total_stocks(total_stocks):
@@ -373,13 +490,18 @@ def update_total_stocks(total_stocks):
         (total_stocks,),
     )
     conn.commit()
-    conn.close()
+
+    # Write through so this worker serves the new value immediately
+    with _total_stocks_lock:
+        _total_stocks_cache["value"] = total_stocks
+        _total_stocks_cache["cached_at"] = time.monotonic()
 
 
 def create_user(name, email, password_hash, initial_stocks=0):
     """Create a new user."""
     conn = get_db_connection()
     try:
+        conn.execute("BEGIN")
         cursor = conn.execute(
             """
             INSERT INTO users (username, name, email, password_hash)
@@ -401,9 +523,8 @@ def create_user(name, email, password_hash, initial_stocks=0):
         conn.commit()
         return user_id
     except sqlite3.IntegrityError:
+        conn.rollback()
         return None
-    finally:
-        conn.close()
 
 
 def update_user_password(user_id, new_password_hash):
@@ -412,7 +533,7 @@ def update_user_password(user_id, new_password_hash):
     try:
         cursor = conn.execute(
             """
-            UPDATE users 
+            UPDATE users
             SET password_hash = ?
             WHERE id = ?
         """,
@@ -420,11 +541,10 @@ def update_user_password(user_id, new_password_hash):
         )
 
         conn.commit()
+        _evict_cached_user(user_id)
         return cursor.rowcount > 0
     except Exception:
         return False
-    finally:
-        conn.close()
 
 
 def delete_user(user_id):
@@ -438,6 +558,8 @@ def delete_user(user_id):
         if user and user["is_admin"]:
             return False  # Cannot delete admin users
 
+        conn.execute("BEGIN")
+
         # Delete stocks first (foreign key)
         conn.execute("DELETE FROM stocks WHERE user_id = ?", (user_id,))
 
@@ -447,173 +569,161 @@ def delete_user(user_id):
         )
 
         conn.commit()
+        _evict_cached_user(user_id)
         return cursor.rowcount > 0
     except Exception:
+        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 
-def record_login_attempt(ip_address):
-    """Record a login attempt for rate limiting."""
-    import time
+def record_login_attempts_bulk(entries):
+    """Insert a batch of (ip_address, attempt_time) audit rows in one transaction.
 
+    Used by the background audit writer so the request hot path never waits
+    on SQLite.
+    """
     conn = get_db_connection()
+    # Pooled connections run in autocommit mode, so without an explicit
+    # BEGIN each row of the executemany would commit (and fsync) on its own
     try:
-        conn.execute(
+        conn.execute("BEGIN")
+        conn.executemany(
             """
             INSERT INTO login_attempts (ip_address, attempt_time)
             VALUES (?, ?)
         """,
-            (ip_address, time.time()),
+            entries,
         )
         conn.commit()
-    finally:
-        conn.close()
-
-
-def check_rate_limit(ip_address, max_attempts=99, window_minutes=5):
-    """Check if IP address has exceeded rate limit.
-
-    Returns (is_limited, attempts_count)
-    """
-    import time
-
-    conn = get_db_connection()
-    try:
-        window_start = time.time() - (window_minutes * 60)
-
-        # Count recent attempts
-        cursor = conn.execute(
-            """
-            SELECT COUNT(*) FROM login_attempts
-            WHERE ip_address = ? AND attempt_time > ?
-        """,
-            (ip_address, window_start),
-        )
-
-        count = cursor.fetchone()[0]
-        return (count >= max_attempts, count)
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
 
 
 def cleanup_old_login_attempts(hours=24):
     """Remove login attempts older than specified hours."""
-    import time
-
     conn = get_db_connection()
-    try:
-        cutoff_time = time.time() - (hours * 3600)
-        conn.execute(
-            """
-            DELETE FROM login_attempts
-            WHERE attempt_time < ?
-        """,
-            (cutoff_time,),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    cutoff_time = time.time() - (hours * 3600)
+    conn.execute(
+        """
+        DELETE FROM login_attempts
+        WHERE attempt_time < ?
+    """,
+        (cutoff_time,),
+    )
+    conn.commit()
 
 
 def record_failed_login_attempt(email, ip_address):
     """Record a failed login attempt for a specific email address."""
-    import time
-
     conn = get_db_connection()
-    try:
-        conn.execute(
-            """
-            INSERT INTO failed_login_attempts (email, ip_address, attempt_time)
-            VALUES (?, ?, ?)
-        """,
-            (email.lower(), ip_address, time.time()),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    conn.execute(
+        """
+        INSERT INTO failed_login_attempts (email, ip_address, attempt_time)
+        VALUES (?, ?, ?)
+    """,
+        (email, ip_address, time.time()),
+    )
+    conn.commit()
 
 
-def check_account_lockout(email, max_attempts=5, lockout_minutes=30):
-    """Check if account is locked due to too many failed login attempts.
+def login_prepare(email, max_attempts=5, lockout_minutes=30):
+    """Fetch the user row and account lockout state in a single query.
 
-    Returns (is_locked, attempts_remaining, lockout_minutes)
+    Returns (user, is_locked, attempts_remaining, lockout_minutes); user is
+    None when the email matches no account. Collapses what used to be
+    separate get_by_email and check_account_lockout round trips.
     """
-    import time
+    window_start = time.time() - (lockout_minutes * 60)
 
+    # The inner LIMIT caps the index scan at max_attempts rows — the
+    # lockout decision never needs a count beyond the threshold
     conn = get_db_connection()
-    try:
-        window_start = time.time() - (lockout_minutes * 60)
-        cursor = conn.execute(
-            """
-            SELECT COUNT(*) as attempts
-            FROM failed_login_attempts
-            WHERE email = ? AND attempt_time > ?
-        """,
-            (email.lower(), window_start),
-        )
+    row = conn.execute(
+        """
+        SELECT u.id, u.name, u.email, u.password_hash, u.is_admin,
+               (SELECT COUNT(*) FROM (
+                    SELECT 1 FROM failed_login_attempts
+                    WHERE email = ? AND attempt_time > ?
+                    LIMIT ?
+               )) AS failed_attempts
+        FROM (SELECT 1)
+        LEFT JOIN users u ON u.email = ?
+    """,
+        (email, window_start, max_attempts, email),
+    ).fetchone()
 
-        result = cursor.fetchone()
-        attempt_count = result[0] if result else 0
+    user = None
+    if row["id"] is not None:
+        user = User(row["id"], row["name"], row["email"], row["is_admin"])
+        user.password_hash = row["password_hash"]
 
-        is_locked = attempt_count >= max_attempts
-        attempts_remaining = max(0, max_attempts - attempt_count)
+    attempt_count = row["failed_attempts"]
+    is_locked = attempt_count >= max_attempts
+    attempts_remaining = max(0, max_attempts - attempt_count)
 
-        return is_locked, attempts_remaining, lockout_minutes
-    finally:
-        conn.close()
+    return user, is_locked, attempts_remaining, lockout_minutes
 
 
 def clear_failed_login_attempts(email):
     """Clear failed login attempts after successful login."""
     conn = get_db_connection()
-    try:
-        conn.execute(
-            """
-            DELETE FROM failed_login_attempts
-            WHERE email = ?
-        """,
-            (email.lower(),),
-        )
-        conn.commit()
-    finally:
-        conn.close()
-
+    conn.execute(
+        """
+        DELETE FROM failed_login_attempts
+        WHERE email = ?
+    """,
+        (email,),
+    )
+    conn.commit()
 
-def revoke_user_sessions(user_id, reason="password_reset"):
-    """Mark all sessions for a user as revoked."""
-    import time
 
+def _load_revocation_watermarks():
+    """Hydrate the in-memory revocation cache from the database."""
+    global _revocation_watermark_loaded_at
     conn = get_db_connection()
-    try:
-        conn.execute(
-            """
-            INSERT OR REPLACE INTO session_revocations (user_id, revoked_at, reason)
-            VALUES (?, ?, ?)
-        """,
-            (user_id, time.time(), reason),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    rows = conn.execute(
+        "SELECT user_id, revoked_at FROM session_revocations"
+    ).fetchall()
+
+    with _revocation_watermark_lock:
+        for row in rows:
+            _revocation_watermark[row["user_id"]] = row["revoked_at"]
+        _revocation_watermark_loaded_at = time.monotonic()
+
+
+def get_revocation_watermark(user_id):
+    """Get the latest revocation time for a user from the in-memory cache.
+
+    Returns None if the user has no recorded revocation, which lets callers
+    skip the database query entirely on the per-request hot path. The cache
+    is re-read after a short TTL so revocations written by other workers
+    are picked up within seconds.
+    """
+    loaded_at = _revocation_watermark_loaded_at
+    if (
+        loaded_at is None
+        or time.monotonic() - loaded_at > _REVOCATION_TTL_SECONDS
+    ):
+        _load_revocation_watermarks()
+
+    with _revocation_watermark_lock:
+        return _revocation_watermark.get(user_id)
 
 
-def is_session_revoked(user_id, session_created_at):
-    """Check if user's session was revoked after session was created."""
+def revoke_user_sessions(user_id, reason="password_reset"):
+    """Mark all sessions for a user as revoked."""
+    revoked_at = time.time()
     conn = get_db_connection()
-    try:
-        cursor = conn.execute(
-            """
-            SELECT revoked_at FROM session_revocations
-            WHERE user_id = ?
-        """,
-            (user_id,),
-        )
-        result = cursor.fetchone()
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO session_revocations (user_id, revoked_at, reason)
+        VALUES (?, ?, ?)
+    """,
+        (user_id, revoked_at, reason),
+    )
+    conn.commit()
 
-        if result and result[0] > session_created_at:
-            return True
-        return False
-    finally:
-        conn.close()
+    with _revocation_watermark_lock:
+        _revocation_watermark[user_id] = revoked_at
+    _evict_cached_user(user_id)
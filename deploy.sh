@@ -63,7 +63,7 @@ echo ""
 echo "🚀 Deployment complete!"
 echo ""
 echo "To start the application:"
-echo "  Production: gunicorn -w 4 -b 0.0.0.0:8000 wsgi:application"
+echo "  Production: gunicorn --worker-class gthread -w 4 --threads 8 -b 0.0.0.0:8000 wsgi:application"
 echo "  Development: python3 app.py"
 echo ""
 echo "⚠️  Important reminders:"
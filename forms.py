@@ -1,24 +1,36 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, IntegerField, TextAreaField, SubmitField
 from wtforms.validators import DataRequired, Email, Length, NumberRange, ValidationError, EqualTo, Regexp
-import re
+_SPECIAL_CHARS = frozenset('!@#$%^&*(),.?":{}|<>')
 
 def validate_strong_password(form, field):
     """Custom validator for strong password requirements."""
     password = field.data
     if len(password) < 12:
         raise ValidationError('Password must be at least 12 characters long.')
-    
-    if not re.search(r'[A-Z]', password):
+
+    # Single pass over the password instead of one scan per character class
+    has_upper = has_lower = has_digit = has_special = False
+    for char in password:
+        if 'A' <= char <= 'Z':
+            has_upper = True
+        elif 'a' <= char <= 'z':
+            has_lower = True
+        elif '0' <= char <= '9':
+            has_digit = True
+        elif char in _SPECIAL_CHARS:
+            has_special = True
+
+    if not has_upper:
         raise ValidationError('Password must contain at least one uppercase letter.')
-    
-    if not re.search(r'[a-z]', password):
+
+    if not has_lower:
         raise ValidationError('Password must contain at least one lowercase letter.')
-    
-    if not re.search(r'\d', password):
+
+    if not has_digit:
         raise ValidationError('Password must contain at least one number.')
-    
-    if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+
+    if not has_special:
         raise ValidationError('Password must contain at least one special character.')
 
 class LoginForm(FlaskForm):
@@ -40,13 +52,6 @@ class UpdateStocksForm(FlaskForm):
     ])
     submit = SubmitField('Update Stockholder')
 
-class UpdateTotalStocksForm(FlaskForm):
-    total_stocks = IntegerField('Total Stocks', validators=[
-        DataRequired(), 
-        NumberRange(min=1, message="Total stocks must be positive")
-    ])
-    submit = SubmitField('Update Total Stocks')
-
 class CreateStockholderForm(FlaskForm):
     name = StringField('Name', validators=[
         DataRequired(),
@@ -20,21 +20,21 @@ from logging.handlers import RotatingFileHandler
 
 if not app.debug:
     # Create logs directory if it doesn't exist
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    
-    # Configure file handler
-    file_handler = RotatingFileHandler('logs/stockholder_portal.log', 
-                                     maxBytes=10240000, backupCount=10)
+    os.makedirs('logs', exist_ok=True)
+
+    # delay=True defers opening the log file until the first record is
+    # emitted, so each gunicorn worker skips the open/stat at import time
+    file_handler = RotatingFileHandler('logs/stockholder_portal.log',
+                                     maxBytes=10240000, backupCount=10,
+                                     delay=True)
     file_handler.setFormatter(logging.Formatter(
         '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
     ))
     file_handler.setLevel(logging.INFO)
-    
+
     # Add handler to app logger
     app.logger.addHandler(file_handler)
     app.logger.setLevel(logging.INFO)
-    app.logger.info('Stockholder Portal startup')
 
 if __name__ == "__main__":
     app.run()